@@ -1,33 +1,135 @@
-from flask import Flask, render_template, request
-
-from ecomm.data_ingestion import ingest_data
+import os
+import uuid
+import logging
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Form, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 
+from ecomm.data_ingestion import open_vector_store
 from ecomm.retrieval_generation import create_conversational_chain
+from ecomm.semantic_cache import SemanticCache
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Run one throwaway query down the same path as /get, on the already started embedding engine, so the
+# embeddings, Astra/Redis connections and async Groq client are initialized before the first real request
+async def warm_up(app):
+    await app.state.cache.aget("warmup")
+    await app.state.chain.ainvoke({"input": "warmup"}, config={"configurable": {"session_id": "__warmup__"}})
+    app.state.chain.get_session_history("__warmup__").clear()
+
+# Build everything inside the server's lifespan; the blocking setup runs in a worker thread so it stays off the event loop.
+# The vector store is opened (and, unless INGEST_ON_STARTUP=false, ingested into) once here, and the embedding engine
+# it starts keeps running until shutdown
+@asynccontextmanager
+async def lifespan(app):
+    vector_store = open_vector_store(ingest=None)
+    embedding, search_store = await run_in_threadpool(vector_store.__enter__)
+    try:
+        app.state.chain = await run_in_threadpool(create_conversational_chain, search_store)
+
+        # Serve repeated questions from a semantic cache instead of re-running the RAG chain
+        app.state.cache = SemanticCache(
+            embedding=embedding,
+            similarity_threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+            max_size=int(os.getenv("SEMANTIC_CACHE_SIZE", "1000"))
+        )
+
+        # Bound the number of chats running against Groq/Astra at once; extra requests wait their turn in a
+        # queue of at most MAX_QUEUED_CHATS, beyond which /get turns requests away
+        app.state.chat_slots = asyncio.Semaphore(int(os.getenv("MAX_CONCURRENT_CHATS", "16")))
+        app.state.max_queued_chats = int(os.getenv("MAX_QUEUED_CHATS", "64"))
+        app.state.queued_chats = 0
+
+        # Warm up only once the embedding engine is running, so it stays warm for real requests. A failed
+        # warm-up (e.g. a Groq outage or rate limit) only costs the first request its latency, so start anyway
+        if os.getenv("WARMUP", "true").lower() == "true":
+            try:
+                await warm_up(app)
+            except Exception as e:
+                logger.warning(f"Warm-up failed, starting without it: {e}")
+        yield
+    finally:
+        await run_in_threadpool(vector_store.__exit__, None, None, None)
+
+app = FastAPI(lifespan=lifespan)
+app.mount("/static", StaticFiles(directory="static"), name="static")
+templates = Jinja2Templates(directory="templates")
+
+@app.get("/")
+async def index(request: Request):
+    return templates.TemplateResponse(request, "chat.html")
+
+# Wait for a chat slot, counting this request as queued until it gets one
+@asynccontextmanager
+async def chat_slot(state):
+    state.queued_chats += 1
+    try:
+        await state.chat_slots.acquire()
+    finally:
+        state.queued_chats -= 1
+    try:
+        yield
+    finally:
+        state.chat_slots.release()
+
+# Format text as one server-sent event, splitting it into data lines so embedded newlines survive
+def format_sse(text):
+    return "".join(f"data: {line}\n" for line in text.split("\n")) + "\n"
+
+@app.post("/get")
+async def chat(request: Request, msg: str = Form(...)):
+    chain = request.app.state.chain
+    cache = request.app.state.cache
+    state = request.app.state
 
-# Ingest data and create vector store
-vstore, insert_ids = ingest_data()
-chain = create_conversational_chain(vstore)
+    # Keep chat history per browser session rather than one shared history
+    session_id = request.cookies.get("session_id") or uuid.uuid4().hex
+    input = msg
 
-app = Flask(__name__)
+    # Only first-turn questions are answered from or stored in the semantic cache; follow-ups depend on the
+    # session's own history, so they always go through the chain
+    history = chain.get_session_history(session_id)
+    use_cache = not history.messages
+    vector, cached = await cache.aget(input) if use_cache else (None, None)
 
-@app.route("/")
-def index():
-    return render_template("chat.html")
+    # Turn the request away rather than let the wait queue grow without bound under load
+    if cached is None and state.chat_slots.locked() and state.queued_chats >= state.max_queued_chats:
+        raise HTTPException(status_code=503, detail="Too many chats in progress. Please try again shortly.")
 
-@app.route("/get", methods=["POST", "GET"])
-def chat():
-    if request.method == "POST":
-        msg = request.form["msg"]
-        input = msg
+    # Stream the answer as it is generated so the first tokens show up without waiting for the rest
+    async def generate():
+        if cached is not None:
+            # Record the exchange so follow-up questions in this session still have their context
+            history.add_user_message(input)
+            history.add_ai_message(str(cached))
+            yield format_sse(str(cached))
+            return
 
-        result = chain.invoke(
-            {"input": input},
-            config={
-                "configurable": {"session_id": "sha"}
-            },
-        )["answer"]
+        answer = []
+        async with chat_slot(state):
+            async for chunk in chain.astream(
+                {"input": input},
+                config={
+                    "configurable": {"session_id": session_id}
+                },
+            ):
+                if "answer" in chunk:
+                    answer.append(chunk["answer"])
+                    yield format_sse(chunk["answer"])
+        if use_cache:
+            cache.set(vector, "".join(answer))
 
-        return str(result)
+    response = StreamingResponse(generate(), media_type="text/event-stream")
+    response.set_cookie("session_id", session_id, httponly=True, samesite="lax")
+    return response
 
 if __name__ == '__main__':
-    app.run(host="0.0.0.0", port=5000, debug=False)
+    import uvicorn
+    uvicorn.run("app:app", host="0.0.0.0", port=5000, loop="uvloop")
@@ -1,18 +1,42 @@
+import os
+import hashlib
 import pandas as pd
+import pyarrow.parquet as pq
 from langchain_core.documents import Document
 
+DATA_PATH = "data/flipkart_product_review.csv"
+PARQUET_PATH = "data/flipkart_product_review.parquet"
+COLUMNS = ['product_title', 'review']
+
+def data_fingerprint():
+    # SHA256 of the source file, used to tell whether the vector store is up to date
+    sha256 = hashlib.sha256()
+    with open(DATA_PATH, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def convert_to_parquet():
+    # One-time conversion of the needed CSV columns to Parquet
+    product_data = pd.read_csv(DATA_PATH, usecols=COLUMNS, dtype=str)
+    product_data.to_parquet(PARQUET_PATH, index=False)
+
 def data_converter():
-    # Load data and select necessary columns
-    product_data = pd.read_csv("data/flipkart_product_review.csv")
-    data = product_data[['product_title', 'review']]
+    # Build the Parquet copy if it is missing or older than the CSV, then load only the necessary columns
+    if not os.path.exists(PARQUET_PATH) or os.path.getmtime(PARQUET_PATH) < os.path.getmtime(DATA_PATH):
+        convert_to_parquet()
+    records = pq.read_table(PARQUET_PATH, columns=COLUMNS).to_pylist()
 
-    # Convert DataFrame rows to a list of Document objects
+    # Convert records to a list of Document objects
     docs = [
         Document(
-            page_content=row["review"],
-            metadata={"product_name": row["product_title"]}
+            page_content=record["review"],
+            metadata={"product_name": record["product_title"]}
         )
-        for _, row in data.iterrows()
+        for record in records
     ]
 
     return docs
+
+if __name__ == "__main__":
+    convert_to_parquet()
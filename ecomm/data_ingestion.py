@@ -1,17 +1,36 @@
 import os
+import hashlib
 import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from langchain_community.embeddings import HuggingFaceInferenceAPIEmbeddings
-from langchain_openai import OpenAIEmbeddings
+from langchain_community.embeddings import InfinityEmbeddings
+import redis
 from langchain_astradb import AstraDBVectorStore
+from langchain_core.runnables.config import run_in_executor
+from langchain_core.vectorstores import VectorStore
+from langchain_redis import RedisConfig, RedisVectorStore
+from redisvl.schema import IndexSchema
 
-from ecomm.data_converter import data_converter
+from ecomm.data_converter import data_converter, data_fingerprint
+from ecomm.embeddings import (
+    InfinityLocalEmbeddings, Int8Embeddings, OnnxEmbeddings, PrecomputedEmbeddings, SentenceTransformerEmbeddings,
+    calibrate_int8_ranges
+)
 
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+EMBEDDING_MODEL_NAME = "BAAI/bge-base-en-v1.5"
+EMBEDDING_DIMENSIONS = 768
+REDIS_REBUILD_LOCK_TIMEOUT = 600
+INT8_CALIBRATION_SIZE = 200
+INGEST_STATE_COLLECTION = "ecomm_ingest_state"
+ASTRA_IN_FILTER_LIMIT = 100
+
 # Load environment variables
 def load_env_variables():
     try:
@@ -24,8 +43,7 @@ def load_env_variables():
 # Validate necessary environment variables
 def validate_env_variables():
     required_vars = [
-        "HF_TOKEN", "OPENAI_API_KEY", "ASTRA_DB_API_ENDPOINT",
-        "ASTRA_DB_APPLICATION_TOKEN", "ASTRA_DB_KEYSPACE"
+        "ASTRA_DB_API_ENDPOINT", "ASTRA_DB_APPLICATION_TOKEN", "ASTRA_DB_KEYSPACE"
     ]
     missing_vars = [var for var in required_vars if not os.getenv(var)]
     
@@ -35,63 +53,191 @@ def validate_env_variables():
     else:
         logger.info("All required environment variables are set.")
 
-# Initialize embeddings with explicit fallbacks
+# Initialize the BGE embeddings with the backend selected by EMBEDDING_BACKEND
 def initialize_embeddings():
-    embedding_hf = None
-    embedding_oai = None
+    backend = os.getenv("EMBEDDING_BACKEND", "infinity")
+    infinity_api_url = os.getenv("INFINITY_API_URL")
 
-    # Try loading HuggingFace embeddings
     try:
-        embedding_hf = HuggingFaceInferenceAPIEmbeddings(api_key=os.getenv("HF_TOKEN"), model_name="BAAI/bge-base-en-v1.5")
-        logger.info("HuggingFace embeddings initialized successfully.")
-    except Exception as e:
-        logger.error(f"Error initializing HuggingFace embeddings: {e}")
+        if backend == "sentence_transformers":
+            embedding = SentenceTransformerEmbeddings(model_name=EMBEDDING_MODEL_NAME, batch_size=64)
+            logger.info("Half-precision sentence-transformers embeddings initialized successfully.")
+        elif backend == "onnx":
+            embedding = OnnxEmbeddings(
+                model_name=EMBEDDING_MODEL_NAME,
+                model_dir=os.getenv("ONNX_MODEL_DIR", "bge-onnx"),
+                provider=os.getenv("ONNX_PROVIDER", "CPUExecutionProvider"),
+                batch_size=64,
+                quantize=os.getenv("ONNX_QUANTIZE", "false").lower() == "true"
+            )
+            logger.info("ONNX Runtime embeddings initialized successfully.")
+        elif infinity_api_url:
+            embedding = InfinityEmbeddings(model=EMBEDDING_MODEL_NAME, infinity_api_url=infinity_api_url)
+            logger.info(f"Infinity embeddings initialized against server at {infinity_api_url}.")
+        else:
+            import torch
 
-    # Try loading OpenAI embeddings if HuggingFace fails
-    try:
-        embedding_oai = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
-        logger.info("OpenAI embeddings initialized successfully.")
+            embedding = InfinityLocalEmbeddings(
+                model_name=EMBEDDING_MODEL_NAME,
+                device="cuda" if torch.cuda.is_available() else "cpu",
+                batch_size=64
+            )
+            logger.info("Local Infinity embeddings initialized successfully.")
     except Exception as e:
-        logger.error(f"Error initializing OpenAI embeddings: {e}")
+        logger.error(f"Error initializing {backend} embeddings: {e}")
+        raise ValueError("Embedding models are required for vector store.") from e
 
-    if embedding_oai is None and embedding_hf is None:
-        logger.error("No embedding models could be initialized.")
-        raise ValueError("Embedding models are required for vector store.")
+    return embedding
 
-    # Default to OpenAI if HuggingFace initialization failed
-    if embedding_oai is None:
-        embedding_oai = embedding_hf
+# Start the backend's embedding engine, if it has one; it stays running until stop_embeddings
+def start_embeddings(embedding):
+    if isinstance(embedding, InfinityLocalEmbeddings):
+        embedding.start()
 
-    return embedding_oai
+# Stop the backend's embedding engine, if it has one
+def stop_embeddings(embedding):
+    if isinstance(embedding, InfinityLocalEmbeddings):
+        embedding.stop()
 
-# Create and configure the vector store, including embeddings and data ingestion
-def ingest_data():
-    # Ensure environment variables are loaded before using them
-    load_env_variables()
-    validate_env_variables()
+# Load the int8 calibration ranges recorded next to the ingest marker, calibrating on a sample of the reviews and
+# recording them on first use. Queries then always quantize like the stored vectors, even after the data changes
+def load_int8_ranges(embedding):
+    collection_name = get_collection_name()
+    state_vstore = create_vector_store(embedding, collection_name=INGEST_STATE_COLLECTION)
+    records = state_vstore.metadata_search(filter={"int8_ranges_for": collection_name}, n=1)
+    if records:
+        logger.info(f"Loaded int8 calibration ranges for {collection_name}.")
+        return [records[0].metadata["min"], records[0].metadata["max"]]
+
+    calibration_texts = [doc.page_content for doc in data_converter()[:INT8_CALIBRATION_SIZE]]
+    ranges = calibrate_int8_ranges(embedding, calibration_texts)
+    state_vstore.add_texts(
+        [f"{collection_name} int8 calibration ranges"],
+        metadatas=[{"int8_ranges_for": collection_name, "min": ranges[0].tolist(), "max": ranges[1].tolist()}],
+        ids=[f"{collection_name}_int8_ranges"]
+    )
+    return ranges
+
+# Optionally quantize to int8 with the collection's calibration ranges; needs a started backend
+def apply_embedding_precision(embedding):
+    if os.getenv("EMBEDDING_PRECISION", "float32") == "int8":
+        embedding = Int8Embeddings(embedding, load_int8_ranges(embedding))
+    return embedding
+
+# Name of the collection (and Redis index) holding vectors at the configured precision
+def get_collection_name():
+    return "ecomm_int8" if os.getenv("EMBEDDING_PRECISION", "float32") == "int8" else "ecomm"
+
+# Datatype of the vectors stored in Redis; int8 vectors are mirrored as int8 to keep the in-memory index small
+def get_redis_vector_datatype():
+    return "int8" if os.getenv("EMBEDDING_PRECISION", "float32") == "int8" else "float32"
+
+# Create the AstraDB vector store for the configured collection (or the named one) with the given embeddings
+def create_vector_store(embedding, collection_name=None):
+    return AstraDBVectorStore(
+        collection_name=collection_name or get_collection_name(),
+        embedding=embedding,
+        api_endpoint=os.getenv("ASTRA_DB_API_ENDPOINT"),
+        token=os.getenv("ASTRA_DB_APPLICATION_TOKEN"),
+        namespace=os.getenv("ASTRA_DB_KEYSPACE")
+    )
+
+# Embed all documents in one batched pass, then insert them through a store that reuses those vectors
+def add_documents_precomputed(embedding, docs):
+    texts = [doc.page_content for doc in docs]
+    vectors = embedding.embed_documents(texts)
+    logger.info(f"Computed {len(vectors)} embeddings.")
+
+    ingest_vstore = create_vector_store(PrecomputedEmbeddings(embedding, texts, vectors))
+    return add_documents_in_batches(ingest_vstore, docs)
+
+# Add documents to the vector store in parallel batches so insert round-trips overlap
+def add_documents_in_batches(vstore, docs):
+    batch_size = int(os.getenv("INGEST_BATCH_SIZE", "128"))
+    max_workers = int(os.getenv("INGEST_MAX_WORKERS", "8"))
+
+    batches = [docs[i:i + batch_size] for i in range(0, len(docs), batch_size)]
+    logger.info(f"Ingesting {len(docs)} documents in {len(batches)} batches of up to {batch_size}.")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        insert_ids = [i for ids in executor.map(vstore.add_documents, batches) for i in ids]
 
-    # Initialize embeddings
-    embedding_oai = initialize_embeddings()
+    return insert_ids
 
+# Fingerprint of the data whose ingestion into the collection last completed, or None if none did
+def get_ingested_fingerprint(state_vstore):
+    markers = state_vstore.metadata_search(filter={"collection": get_collection_name()}, n=1)
+    return markers[0].metadata["source_sha256"] if markers else None
+
+# Record that every document of this version of the data made it into the collection
+def mark_ingested(state_vstore, fingerprint):
+    collection_name = get_collection_name()
+    state_vstore.add_texts(
+        [f"{collection_name} ingested from {fingerprint}"],
+        metadatas=[{"collection": collection_name, "source_sha256": fingerprint}],
+        ids=[collection_name]
+    )
+
+# Tag documents with the data fingerprint and a content-derived id so re-ingestion upserts instead of duplicating
+def tag_documents(docs, fingerprint):
+    for doc in docs:
+        doc.metadata["source_sha256"] = fingerprint
+        doc.id = hashlib.sha256(f"{doc.metadata['product_name']}\n{doc.page_content}".encode("utf-8")).hexdigest()
+    return docs
+
+# Return which of the given document ids are already in the collection
+def find_existing_ids(vstore, ids):
+    collection = vstore.astra_env.collection
+    existing_ids = set()
+    for i in range(0, len(ids), ASTRA_IN_FILTER_LIMIT):
+        cursor = collection.find({"_id": {"$in": ids[i:i + ASTRA_IN_FILTER_LIMIT]}}, projection={"_id": True})
+        existing_ids.update(doc["_id"] for doc in cursor)
+    return existing_ids
+
+# Stamp documents that are unchanged in this version of the data with its fingerprint, so the stale-document cleanup keeps them
+def refresh_fingerprint(vstore, ids, fingerprint):
+    collection = vstore.astra_env.collection
+    for i in range(0, len(ids), ASTRA_IN_FILTER_LIMIT):
+        collection.update_many(
+            {"_id": {"$in": ids[i:i + ASTRA_IN_FILTER_LIMIT]}},
+            {"$set": {"metadata.source_sha256": fingerprint}}
+        )
+
+# Create the vector store and ingest the data into it unless it is already up to date
+def ingest_data(embedding):
     try:
         # Create AstraDB Vector Store
-        vstore = AstraDBVectorStore(
-            collection_name="ecomm",
-            embedding=embedding_oai,
-            api_endpoint=os.getenv("ASTRA_DB_API_ENDPOINT"),
-            token=os.getenv("ASTRA_DB_APPLICATION_TOKEN"),
-            namespace=os.getenv("ASTRA_DB_KEYSPACE")
-        )
+        vstore = create_vector_store(embedding)
         logger.info("Vector store created successfully.")
 
+        # Completion markers live in their own small collection so they never show up in retrieval
+        state_vstore = create_vector_store(embedding, collection_name=INGEST_STATE_COLLECTION)
+
+        # Skip ingestion when a complete ingestion of this version of the data was recorded
+        fingerprint = data_fingerprint()
+        if get_ingested_fingerprint(state_vstore) == fingerprint:
+            logger.info(f"Vector store already holds data {fingerprint[:12]}; skipping ingestion.")
+            return vstore, []
+
         # Ingest data into the vector store
         docs = data_converter()  # Ensure this returns a list of Document objects
         if not docs:
             logger.warning("No documents returned by data_converter. Please check your data source.")
+        docs = tag_documents(docs, fingerprint)
+
+        # Only rows whose content-derived id is not in the collection yet need embedding
+        existing_ids = find_existing_ids(vstore, [doc.id for doc in docs])
+        new_docs = [doc for doc in docs if doc.id not in existing_ids]
+        logger.info(f"{len(new_docs)} of {len(docs)} documents are new.")
 
-        # Add documents to the vector store
-        insert_ids = vstore.add_documents(docs)
+        # Embed the new documents up front and add them to the vector store in batches
+        insert_ids = add_documents_precomputed(embedding, new_docs) if new_docs else []
         logger.info(f"Inserted {len(insert_ids)} documents into vector store.")
+        refresh_fingerprint(vstore, list(existing_ids), fingerprint)
+
+        # Drop documents left over from earlier versions of the data, then record that ingestion completed
+        vstore.delete_by_metadata_filter({"source_sha256": {"$ne": fingerprint}})
+        mark_ingested(state_vstore, fingerprint)
         
         return vstore, insert_ids
     
@@ -99,6 +245,173 @@ def ingest_data():
         logger.error(f"Error during vector store creation or data ingestion: {e}")
         raise  # Re-raise exception after logging
 
+# Read every document of the collection together with its stored vector
+def fetch_all_documents(vstore):
+    return list(vstore.astra_env.collection.find(
+        {}, projection={"_id": True, "content": True, "metadata": True, "$vector": True}
+    ))
+
+# Redis key naming the data version the mirror currently serves
+def get_redis_fingerprint_key():
+    return f"{get_collection_name()}:source_sha256"
+
+# Each version of the data is mirrored into its own Redis index, so a rebuild never touches the index being served
+def get_redis_index_name(fingerprint):
+    return f"{get_collection_name()}_{fingerprint[:16]}"
+
+# Check whether a Redis search index exists
+def redis_index_exists(client, index_name):
+    try:
+        client.ft(index_name).info()
+        return True
+    except redis.ResponseError:
+        return False
+
+# Whether Redis serves this version of the data; the pointer or index is gone after a Redis restart or flush
+def is_redis_mirror_current(client, fingerprint):
+    return (
+        client.get(get_redis_fingerprint_key()) == fingerprint.encode()
+        and redis_index_exists(client, get_redis_index_name(fingerprint))
+    )
+
+# Redis index config for the mirror: HNSW over the BGE vectors, with the dimension set up front so no probe embedding is needed
+def create_redis_config(redis_url, index_name):
+    schema = IndexSchema.from_dict({
+        "index": {"name": index_name, "prefix": index_name, "storage_type": "hash"},
+        "fields": [
+            {"name": "text", "type": "text"},
+            {
+                "name": "embedding",
+                "type": "vector",
+                "attrs": {
+                    "dims": EMBEDDING_DIMENSIONS,
+                    "algorithm": "hnsw",
+                    "distance_metric": "cosine",
+                    "datatype": get_redis_vector_datatype(),
+                    "ef_runtime": int(os.getenv("REDIS_HNSW_EF_RUNTIME", "10")),
+                },
+            },
+            {"name": "product_name", "type": "text"},
+            {"name": "source_sha256", "type": "tag"},
+        ],
+    })
+    return RedisConfig(
+        index_name=index_name,
+        key_prefix=index_name,
+        redis_url=redis_url,
+        index_schema=schema,
+        vector_datatype=get_redis_vector_datatype().upper(),
+        embedding_dimensions=EMBEDDING_DIMENSIONS
+    )
+
+# Read-only store that searches whichever Redis index the fingerprint key points at, so readers move to a
+# rebuilt mirror without restarting
+class RedisMirrorVectorStore(VectorStore):
+    def __init__(self, embedding, redis_url):
+        self.embedding = embedding
+        self.redis_url = redis_url
+        self.client = redis.Redis.from_url(redis_url)
+        self.stores = {}
+        self.lock = threading.Lock()
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def _current_store(self):
+        fingerprint = self.client.get(get_redis_fingerprint_key())
+        if fingerprint is None:
+            raise RuntimeError(
+                "The Redis mirror is missing; restart the app or run python -m ecomm.data_ingestion to rebuild it."
+            )
+        index_name = get_redis_index_name(fingerprint.decode())
+        with self.lock:
+            if index_name not in self.stores:
+                config = create_redis_config(self.redis_url, index_name)
+                self.stores = {index_name: RedisVectorStore(self.embedding, config=config)}
+            return self.stores[index_name]
+
+    def _similarity_search_by_vector(self, vector, k, **kwargs):
+        return self._current_store().similarity_search_by_vector(vector, k=k, **kwargs)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self._similarity_search_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    # langchain_redis has no async search of its own, so embed the query with the async embedding API and only run the search in an executor
+    async def asimilarity_search(self, query, k=4, **kwargs):
+        vector = await self.embedding.aembed_query(query)
+        return await run_in_executor(None, self._similarity_search_by_vector, vector, k, **kwargs)
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("The Redis mirror is read-only; ingest into AstraDB instead.")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("The Redis mirror is read-only; ingest into AstraDB instead.")
+
+# Copy the collection, with the vectors already stored in AstraDB, into a new Redis index for this version of the
+# data, point readers at it and drop the previous version's index
+def rebuild_redis_mirror(client, redis_url, vstore, fingerprint):
+    fingerprint_key = get_redis_fingerprint_key()
+    index_name = get_redis_index_name(fingerprint)
+
+    # Read from AstraDB before taking the lock, so the lock only has to outlast the Redis writes
+    records = fetch_all_documents(vstore)
+    texts = [record["content"] for record in records]
+    vectors = [record["$vector"] for record in records]
+
+    # Only one process rebuilds at a time; others wait for it and then find the mirror up to date
+    with client.lock(f"{get_collection_name()}:rebuild_lock", timeout=REDIS_REBUILD_LOCK_TIMEOUT):
+        previous = client.get(fingerprint_key)
+        if is_redis_mirror_current(client, fingerprint):
+            logger.info(f"Redis mirror was rebuilt by another process for data {fingerprint[:12]}.")
+            return
+
+        # Nothing serves from this version's index yet, so clearing what a failed earlier attempt left behind is safe
+        ingest_rvstore = RedisVectorStore(
+            PrecomputedEmbeddings(vstore.embeddings, texts, vectors), config=create_redis_config(redis_url, index_name)
+        )
+        ingest_rvstore.index.create(overwrite=True, drop=True)
+        ingest_rvstore.add_texts(
+            texts, metadatas=[record["metadata"] for record in records], keys=[record["_id"] for record in records]
+        )
+        client.set(fingerprint_key, fingerprint)
+        logger.info(f"Mirrored {len(records)} documents into Redis HNSW index {index_name}.")
+
+        # Readers follow the fingerprint key, so the previous version's index can go once the key has moved
+        if previous is not None and previous != fingerprint.encode():
+            previous_index_name = get_redis_index_name(previous.decode())
+            if redis_index_exists(client, previous_index_name):
+                client.ft(previous_index_name).dropindex(delete_documents=True)
+                logger.info(f"Dropped Redis index {previous_index_name}.")
+
+# Mirror the collection into an in-memory Redis HNSW index for retrieval when REDIS_URL is set; AstraDB stays the source of truth.
+# The mirror follows the last completed ingestion and is rebuilt whenever it is behind or missing, e.g. after a Redis restart
+def mirror_to_redis(vstore):
+    redis_url = os.getenv("REDIS_URL")
+    if not redis_url:
+        return vstore
+
+    try:
+        client = redis.Redis.from_url(redis_url)
+        state_vstore = create_vector_store(vstore.embeddings, collection_name=INGEST_STATE_COLLECTION)
+        fingerprint = get_ingested_fingerprint(state_vstore)
+        if fingerprint is None:
+            raise ValueError(
+                f"No completed ingestion into {get_collection_name()}; run python -m ecomm.data_ingestion first."
+            )
+
+        if is_redis_mirror_current(client, fingerprint):
+            logger.info(f"Redis mirror already holds data {fingerprint[:12]}; skipping rebuild.")
+        else:
+            rebuild_redis_mirror(client, redis_url, vstore, fingerprint)
+
+        return RedisMirrorVectorStore(vstore.embeddings, redis_url)
+
+    except Exception as e:
+        logger.error(f"Error mirroring vector store into Redis: {e}")
+        raise  # Re-raise exception after logging
+
 # Perform similarity search on the vector store
 def search_vector_store(vstore, query):
     try:
@@ -112,4 +425,30 @@ def search_vector_store(vstore, query):
         logger.error(f"Error during vector store search: {e}")
         raise  # Re-raise exception after logging
 
+# The start-up sequence shared by the app, the chat script and the ingest script: load the configuration, start the
+# embeddings and bring up the vector store, ingesting the data first when ingest is set (or, when it is None, unless
+# INGEST_ON_STARTUP=false). Yields the embeddings and the store to search (the Redis mirror when REDIS_URL is set)
+# and stops the embedding engine on exit
+@contextmanager
+def open_vector_store(ingest=True):
+    load_env_variables()
+    validate_env_variables()
+    if ingest is None:
+        ingest = os.getenv("INGEST_ON_STARTUP", "true").lower() == "true"
+    base_embedding = initialize_embeddings()
+    start_embeddings(base_embedding)
+    try:
+        embedding = apply_embedding_precision(base_embedding)
+        if ingest:
+            vstore, insert_ids = ingest_data(embedding)
+            logger.info(f"Ingested {len(insert_ids)} new documents.")
+        else:
+            vstore = create_vector_store(embedding)
+        yield embedding, mirror_to_redis(vstore)
+    finally:
+        stop_embeddings(base_embedding)
 
+# Ingest the data and build the Redis mirror once, for deployments that start the app with INGEST_ON_STARTUP=false
+if __name__ == "__main__":
+    with open_vector_store():
+        pass
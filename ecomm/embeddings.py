@@ -0,0 +1,217 @@
+import os
+import asyncio
+import logging
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# BGE embeddings from Infinity's in-process engine. The engine runs on a background event loop between
+# start() and stop(), so sync and async callers on any thread share one running, batching engine
+class InfinityLocalEmbeddings(Embeddings):
+    def __init__(self, model_name, device, batch_size=64):
+        from langchain_community.embeddings import InfinityEmbeddingsLocal
+
+        self.embedder = InfinityEmbeddingsLocal(model=model_name, device=device, batch_size=batch_size)
+        self.loop = None
+        self.thread = None
+
+    def start(self):
+        if self.loop is not None:
+            return
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="infinity-engine", daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.embedder.__aenter__(), self.loop).result()
+        logger.info("Infinity engine started.")
+
+    def stop(self):
+        if self.loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.embedder.__aexit__(None, None, None), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
+        self.thread = None
+        logger.info("Infinity engine stopped.")
+
+    def _submit(self, method, *args):
+        if self.loop is None:
+            raise RuntimeError("Infinity engine is not running; call start() first.")
+        return asyncio.run_coroutine_threadsafe(method(*args), self.loop)
+
+    def embed_documents(self, texts):
+        return self._submit(self.embedder.aembed_documents, texts).result()
+
+    def embed_query(self, text):
+        return self._submit(self.embedder.aembed_query, text).result()
+
+    async def aembed_documents(self, texts):
+        return await asyncio.wrap_future(self._submit(self.embedder.aembed_documents, texts))
+
+    async def aembed_query(self, text):
+        return await asyncio.wrap_future(self._submit(self.embedder.aembed_query, text))
+
+# Pick a half-precision dtype for the device: FP16 on CUDA, BF16 on CPUs with AVX512_BF16, else keep FP32
+def select_half_precision_dtype(device):
+    import torch
+
+    if device == "cuda":
+        return torch.float16
+    is_bf16_supported = getattr(torch.cpu, "_is_avx512_bf16_supported", None)
+    if device == "cpu" and is_bf16_supported is not None and is_bf16_supported():
+        return torch.bfloat16
+    return None
+
+# BGE embeddings computed in-process with sentence-transformers at reduced precision
+class SentenceTransformerEmbeddings(Embeddings):
+    def __init__(self, model_name, device=None, batch_size=64):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.batch_size = batch_size
+        self.dtype = select_half_precision_dtype(self.device)
+        # Requests from concurrent workers queue up here so only one forward pass runs on the model at a time
+        self.lock = threading.Lock()
+
+        self.model = SentenceTransformer(model_name, device=self.device)
+        if self.dtype is not None:
+            self.model.to(self.dtype)
+        logger.info(f"Loaded {model_name} on {self.device} with dtype {self.dtype or torch.float32}.")
+
+    def _encode(self, texts):
+        import torch
+
+        with self.lock, torch.autocast(device_type=self.device, dtype=self.dtype, enabled=self.dtype is not None):
+            vectors = self.model.encode(
+                texts,
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
+        return vectors.tolist()
+
+    def embed_documents(self, texts):
+        return self._encode(texts)
+
+    def embed_query(self, text):
+        return self._encode([text])[0]
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+
+# Export the model to ONNX in model_dir, unless an export is already there
+def export_onnx_model(model_name, model_dir):
+    if os.path.isfile(os.path.join(model_dir, ONNX_MODEL_FILE)):
+        return
+
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from transformers import AutoTokenizer
+
+    logger.info(f"No ONNX export found at {model_dir}; exporting {model_name}.")
+    model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+    model.save_pretrained(model_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(model_dir)
+
+# Write an INT8 dynamically quantized copy of the ONNX export next to it, unless one is already there
+def quantize_onnx_model(model_dir):
+    if os.path.isfile(os.path.join(model_dir, ONNX_QUANTIZED_MODEL_FILE)):
+        return
+
+    from optimum.onnxruntime import ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    logger.info(f"Quantizing the ONNX export in {model_dir} to INT8.")
+    quantizer = ORTQuantizer.from_pretrained(model_dir, file_name=ONNX_MODEL_FILE)
+    qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    quantizer.quantize(save_dir=model_dir, quantization_config=qconfig)
+
+# Load the ONNX export of the model, exporting (and quantizing) it into model_dir on first use
+def load_onnx_model(model_name, model_dir, provider, quantize=False):
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+
+    export_onnx_model(model_name, model_dir)
+    file_name = ONNX_MODEL_FILE
+    if quantize:
+        quantize_onnx_model(model_dir)
+        file_name = ONNX_QUANTIZED_MODEL_FILE
+
+    return ORTModelForFeatureExtraction.from_pretrained(model_dir, file_name=file_name, provider=provider)
+
+# BGE embeddings computed with ONNX Runtime on a graph-optimized export of the model
+class OnnxEmbeddings(Embeddings):
+    def __init__(self, model_name, model_dir="bge-onnx", provider="CPUExecutionProvider", batch_size=64, quantize=False):
+        from transformers import AutoTokenizer
+
+        self.batch_size = batch_size
+        self.model = load_onnx_model(model_name, model_dir, provider, quantize=quantize)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        logger.info(f"Loaded {'INT8 ' if quantize else ''}ONNX model from {model_dir} with {provider}.")
+
+    def _encode(self, texts):
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            inputs = self.tokenizer(
+                texts[i:i + self.batch_size], padding=True, truncation=True, max_length=512, return_tensors="np"
+            )
+            outputs = self.model(**inputs)
+            # BGE is trained with CLS pooling, so take the first token rather than mean-pooling
+            cls = outputs.last_hidden_state[:, 0]
+            vectors.append(cls / np.linalg.norm(cls, axis=1, keepdims=True))
+        return np.concatenate(vectors).tolist() if vectors else []
+
+    def embed_documents(self, texts):
+        return self._encode(texts)
+
+    def embed_query(self, text):
+        return self._encode([text])[0]
+
+# Serves vectors computed ahead of time for known texts, embedding anything else with the wrapped model
+class PrecomputedEmbeddings(Embeddings):
+    def __init__(self, embedding, texts, vectors):
+        self.embedding = embedding
+        self.vectors = dict(zip(texts, vectors))
+
+    def embed_documents(self, texts):
+        missing = [text for text in texts if text not in self.vectors]
+        if missing:
+            self.vectors.update(zip(missing, self.embedding.embed_documents(missing)))
+        return [self.vectors[text] for text in texts]
+
+    def embed_query(self, text):
+        return self.embedding.embed_query(text)
+
+# Per-dimension [min, max] ranges of the embeddings of sample texts, which calibrate int8 quantization
+def calibrate_int8_ranges(embedding, calibration_texts):
+    vectors = np.asarray(embedding.embed_documents(calibration_texts))
+    logger.info(f"Calibrated int8 quantization on {len(calibration_texts)} texts.")
+    return np.vstack([vectors.min(axis=0), vectors.max(axis=0)])
+
+# Quantizes another model's embeddings to int8 using the given per-dimension calibration ranges
+class Int8Embeddings(Embeddings):
+    def __init__(self, embedding, ranges):
+        self.embedding = embedding
+        self.ranges = np.asarray(ranges)
+
+    def _quantize(self, vectors):
+        from sentence_transformers.quantization import quantize_embeddings
+
+        return quantize_embeddings(np.asarray(vectors), precision="int8", ranges=self.ranges).tolist()
+
+    def embed_documents(self, texts):
+        return self._quantize(self.embedding.embed_documents(texts))
+
+    def embed_query(self, text):
+        return self._quantize([self.embedding.embed_query(text)])[0]
+
+    async def aembed_documents(self, texts):
+        return self._quantize(await self.embedding.aembed_documents(texts))
+
+    async def aembed_query(self, text):
+        return self._quantize([await self.embedding.aembed_query(text)])[0]
@@ -1,21 +1,33 @@
 import os
 import logging
+import threading
+from operator import itemgetter
+import tiktoken
+from cachetools import LRUCache
 from dotenv import load_dotenv
 from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.prompts import MessagesPlaceholder
-from langchain.chains import create_history_aware_retriever
 from langchain_groq import ChatGroq
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableBranch, RunnableLambda, RunnableParallel
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from ecomm.data_ingestion import ingest_data 
+from ecomm.data_ingestion import open_vector_store
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Tokenizer used to measure the retrieved reviews stuffed into the QA prompt
+encoding = tiktoken.get_encoding("cl100k_base")
+
+# Guards the per-session chat history store
+store_lock = threading.Lock()
+
 # Load environment variables and set up logging
 def load_environment():
     try:
@@ -29,33 +41,98 @@ def load_environment():
 # Initialize the ChatGroq model
 def initialize_model():
     try:
-        model = ChatGroq(model="llama-3.1-70b-versatile", temperature=0.5)
+        model = ChatGroq(
+            model="llama-3.1-70b-versatile",
+            temperature=0.5,
+            max_tokens=int(os.getenv("GROQ_MAX_TOKENS", "256")),
+            max_retries=1,
+            service_tier=os.getenv("GROQ_SERVICE_TIER", "auto")
+        )
         logger.info("Model initialized successfully.")
         return model
     except Exception as e:
         logger.error(f"Error initializing model: {e}")
         raise
 
-# Initialize session history storage
-def get_session_history(session_id: str, store: dict) -> BaseChatMessageHistory:
+# Initialize the small ChatGroq model used only to reformulate follow-up questions
+def initialize_rewrite_model():
     try:
-        if session_id not in store:
-            store[session_id] = ChatMessageHistory()
-        return store[session_id]
+        rewrite_model = ChatGroq(
+            model=os.getenv("GROQ_REWRITE_MODEL", "llama-3.1-8b-instant"),
+            temperature=0,
+            max_tokens=128,
+            max_retries=1,
+            service_tier=os.getenv("GROQ_SERVICE_TIER", "auto")
+        )
+        logger.info("Rewrite model initialized successfully.")
+        return rewrite_model
+    except Exception as e:
+        logger.error(f"Error initializing rewrite model: {e}")
+        raise
+
+# Initialize session history storage, keeping only the last MAX_HISTORY_MESSAGES messages
+def get_session_history(session_id: str, store: LRUCache) -> BaseChatMessageHistory:
+    try:
+        with store_lock:
+            history = store.get(session_id)
+            if history is None:
+                history = store[session_id] = ChatMessageHistory()
+        max_history_messages = int(os.getenv("MAX_HISTORY_MESSAGES", "20"))
+        # A slice of [-0:] would keep everything, so a limit of 0 clears the history explicitly
+        history.messages = history.messages[-max_history_messages:] if max_history_messages > 0 else []
+        return history
     except Exception as e:
         logger.error(f"Error getting session history: {e}")
         raise
 
+# Truncate each document to DOC_TOKEN_LIMIT tokens and stop adding documents once CONTEXT_TOKEN_LIMIT tokens are used
+def truncate_documents(docs):
+    doc_token_limit = int(os.getenv("DOC_TOKEN_LIMIT", "256"))
+    context_token_limit = int(os.getenv("CONTEXT_TOKEN_LIMIT", "512"))
+    truncated = []
+    total_tokens = 0
+    for doc in docs:
+        if truncated and total_tokens >= context_token_limit:
+            break
+        tokens = encoding.encode(doc.page_content)[:doc_token_limit]
+        total_tokens += len(tokens)
+        truncated.append(Document(page_content=encoding.decode(tokens), metadata=doc.metadata))
+    return truncated
+
 # Create a retriever for documents from the vector store
 def create_retriever(vstore):
     try:
-        retriever = vstore.as_retriever(search_kwargs={"k": 3})
+        retriever = vstore.as_retriever(search_kwargs={"k": 3}) | RunnableLambda(truncate_documents)
         logger.info("Retriever created successfully.")
         return retriever
     except Exception as e:
         logger.error(f"Error creating retriever: {e}")
         raise
 
+# Create a history-aware retriever that skips reformulation on the first turn and otherwise
+# retrieves for the raw question while the model reformulates it, reusing those results when
+# the model returns the question unchanged
+def create_speculative_history_aware_retriever(model, retriever, contextualize_q_prompt):
+    try:
+        speculate = RunnableParallel(
+            input=itemgetter("input"),
+            question=contextualize_q_prompt | model | StrOutputParser(),
+            docs=itemgetter("input") | retriever,
+        )
+        pick_docs = RunnableBranch(
+            (lambda x: x["question"].strip() == x["input"].strip(), itemgetter("docs")),
+            itemgetter("question") | retriever,
+        )
+        history_aware_retriever = RunnableBranch(
+            (lambda x: not x.get("chat_history"), itemgetter("input") | retriever),
+            speculate | pick_docs,
+        ).with_config(run_name="chat_retriever_chain")
+        logger.info("History-aware retriever created successfully.")
+        return history_aware_retriever
+    except Exception as e:
+        logger.error(f"Error creating history-aware retriever: {e}")
+        raise
+
 # Create the question answering (QA) prompt template
 def create_qa_prompt():
     try:
@@ -85,7 +162,8 @@ def create_qa_prompt():
 def create_conversational_chain(vstore):
     load_environment()
     model = initialize_model()
-    store = {}
+    rewrite_model = initialize_rewrite_model()
+    store = LRUCache(maxsize=int(os.getenv("SESSION_CACHE_SIZE", "10000")))
     try:
         retriever = create_retriever(vstore)
 
@@ -102,7 +180,7 @@ def create_conversational_chain(vstore):
         )
 
         # Create a history-aware retriever
-        history_aware_retriever = create_history_aware_retriever(model, retriever, contextualize_q_prompt)
+        history_aware_retriever = create_speculative_history_aware_retriever(rewrite_model, retriever, contextualize_q_prompt)
 
         # Create the QA chain
         qa_prompt = create_qa_prompt()
@@ -126,15 +204,9 @@ def create_conversational_chain(vstore):
 # Main function that integrates data ingestion, creation of the vector store, and conversational logic
 def main():
     try:
-        # Load environment variables and initialize model
-
-        # Ingest data and create the vector store
-        vstore, insert_ids = ingest_data()
-
-        # Proceed if documents were inserted
-        if insert_ids:
-           
-            conversational_rag_chain = create_conversational_chain(vstore)
+        # Start the embeddings, ingest data and create the vector store
+        with open_vector_store() as (embedding, search_store):
+            conversational_rag_chain = create_conversational_chain(search_store)
 
             # Perform a query
             answer = conversational_rag_chain.invoke(
@@ -149,8 +221,6 @@ def main():
                 config={"configurable": {"session_id": "dhruv"}}
             )["answer"]
             logger.info(f"Response: {answer1}")
-        else:
-            logger.warning("No documents were inserted into the vector store.")
 
     except Exception as e:
         logger.error(f"An error occurred during the execution: {e}")
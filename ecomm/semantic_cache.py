@@ -0,0 +1,48 @@
+import logging
+import threading
+import numpy as np
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# In-memory cache of answers keyed by query embedding, matched on cosine similarity
+class SemanticCache:
+    def __init__(self, embedding, similarity_threshold=0.95, max_size=1000):
+        self.embedding = embedding
+        self.similarity_threshold = similarity_threshold
+        self.max_size = max_size
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.answers = []
+        self.lock = threading.Lock()
+
+    async def _aembed(self, query):
+        vector = np.asarray(await self.embedding.aembed_query(query), dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    # Return the query embedding and the cached answer for the most similar query (None below the threshold)
+    async def aget(self, query):
+        return self._lookup(await self._aembed(query))
+
+    def _lookup(self, vector):
+        with self.lock:
+            if not self.answers:
+                return vector, None
+            scores = self.vectors @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return vector, None
+            logger.info(f"Semantic cache hit with similarity {scores[best]:.3f}.")
+            return vector, self.answers[best]
+
+    # Store an answer under an already-computed query embedding, evicting the oldest entry when full
+    def set(self, vector, answer):
+        with self.lock:
+            if not self.answers:
+                self.vectors = vector[np.newaxis, :]
+            else:
+                self.vectors = np.vstack([self.vectors, vector])
+            self.answers.append(answer)
+            if len(self.answers) > self.max_size:
+                self.vectors = self.vectors[1:]
+                self.answers.pop(0)